@@ -5,6 +5,7 @@ from typing import Callable, TYPE_CHECKING
 from warnings import warn
 from functools import wraps
 from importlib import import_module
+from importlib.util import find_spec
 from pathlib import Path
 
 if TYPE_CHECKING:
@@ -49,17 +50,23 @@ class Resources:
 
     @staticmethod
     def _check_module(module_name: str) -> bool:
-        """Checks if a module can be imported.
+        """Checks if a module is available.
+
+        Third-party packages are only located rather than imported, as importing some (e.g. numba) takes far longer
+        than importing this package; they are imported where used. Subpackages of this package are imported, as they
+        are only available if their own dependencies are.
 
         Args:
             module_name (str): The name of the module to check.
 
         Returns:
-            bool: True if the module can be imported, False otherwise.
+            bool: True if the module is available, False otherwise.
         """
         try:
-            import_module(module_name)
-            return True
+            if module_name.startswith(f'{__name__}.'):
+                import_module(module_name)
+                return True
+            return find_spec(module_name) is not None
         except ImportError:
             return False
 
@@ -123,4 +130,4 @@ def require(*packages: str) -> Callable:
 
 
 # Constants ------------------------------------------------------------------------------------------------------------
-RESOURCES = Resources('pathogenx.app')
+RESOURCES = Resources('pathogenx.app', 'numba', 'pyarrow')
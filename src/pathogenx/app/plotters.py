@@ -7,11 +7,10 @@ from pathlib import Path
 import pandas as pd
 import numpy as np
 import geopandas
-from scipy.stats import norm
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
-from pathogenx.calculators import PrevalenceResult
+from pathogenx.calculators import PrevalenceResult, _Z
 
 # Constants ------------------------------------------------------------------------------------------------------------
 _NE_COUNTRIES = Path(__file__).parent / "data" / "world-administrative-boundaries"
@@ -361,9 +360,8 @@ class CoveragePlotter:
         # cumulative error by summing the individual standard errors in quadrature.
         plot_data['cum_se'] = np.sqrt(grouped['se_squared'].cumsum())
 
-        z = norm.ppf(1 - (0.05 / 2))
-        plot_data['cum_lower'] = (plot_data['cum_prop'] - z * plot_data['cum_se']).clip(0, 1)
-        plot_data['cum_upper'] = (plot_data['cum_prop'] + z * plot_data['cum_se']).clip(0, 1)
+        plot_data['cum_lower'] = (plot_data['cum_prop'] - _Z * plot_data['cum_se']).clip(0, 1)
+        plot_data['cum_upper'] = (plot_data['cum_prop'] + _Z * plot_data['cum_se']).clip(0, 1)
 
         # Create hover text
         hover_text = (
@@ -144,7 +144,7 @@ def main_server(input: Inputs, output: Outputs, session: Session):
             # Only proceed if a column has been selected from the dropdown.
             # This check handles both None and empty string ""
             if selected_col := input[f"{var}_variable"]():
-                col_data = d.data[selected_col]
+                col_data = d[selected_col]  # Read-only, so avoid copying the whole frame via Dataset.data
                 if var == 'temporal':
                     min_, max_ = int(col_data.min()), int(col_data.max())
                     ui.update_slider(f"{var}_filter", min=min_, max=max_, value=(min_, max_))
@@ -164,11 +164,10 @@ def main_server(input: Inputs, output: Outputs, session: Session):
     def summary():
         if (dataset := reactive_dataset.get()) is None or len(dataset) == 0:
             return ''
-        d = dataset.data
         if (f := reactive_data()) is None or f.empty:
-            return f"Samples: 0/{len(d)}"
-        out = [f"Samples: {len(f)}/{len(d)}"]
-        out += [f'{f[i].nunique()}/{d[i].nunique()} unique {i} {v} variables' for v in _VAR_CATEGORIES if (i := input[v]())]
+            return f"Samples: 0/{len(dataset)}"
+        out = [f"Samples: {len(f)}/{len(dataset)}"]
+        out += [f'{f[i].nunique()}/{dataset[i].nunique()} unique {i} {v} variables' for v in _VAR_CATEGORIES if (i := input[v]())]
         return '; '.join(out)
 
     @reactive.calc
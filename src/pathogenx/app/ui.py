@@ -3,14 +3,16 @@ Module for dealing with the web-app user interface
 """
 from shiny import ui
 from typing import get_args
-from faicons import icon_svg as icon
+from types import MappingProxyType
 from shinyswatch import theme
 from shinywidgets import output_widget
-from pathogenx.app.utils import create_logo_link
+from pathogenx.app.utils import create_logo_link, _ICONS
 from pathogenx.io import _GENOTYPE_FLAVOURS, _META_FLAVOURS, _DIST_FLAVOURS
 
 # Constants ------------------------------------------------------------------------------------------------------------
-_FLAVOURS = {'genotype': get_args(_GENOTYPE_FLAVOURS), 'metadata': get_args(_META_FLAVOURS), 'distance': get_args(_DIST_FLAVOURS)}
+_FLAVOURS = MappingProxyType({
+    'genotype': get_args(_GENOTYPE_FLAVOURS), 'metadata': get_args(_META_FLAVOURS), 'distance': get_args(_DIST_FLAVOURS)
+})
 _VAR_CATEGORIES = ('genotype', 'adjustment', 'spatial', 'temporal', 'custom')
 
 # Define all hyperlinked images here -------------------------------------------
@@ -21,16 +23,14 @@ lshtm_logo = create_logo_link("lshtm.png", "www.lshtm.ac.uk", "70px")
 
 # Define footer ----------------------------------------------------------------
 footer = ui.div(
+    ui.tags.style(
+        ".pgx-logo-row { display: flex; align-items: center; flex-wrap: nowrap; }"
+        ".pgx-logo-row--between { justify-content: space-between; }"
+    ),
     ui.div(
-        ui.div(
-            lshtm_logo, monash_logo,
-            style="display: flex; align-items: center; flex-wrap: nowrap;"
-        ),
-        ui.div(
-            kaptive_logo, kleborate_logo,
-            style="display: flex; align-items: center; flex-wrap: nowrap;"
-        ),
-        style="display: flex; justify-content: space-between; align-items: center;",
+        ui.div(lshtm_logo, monash_logo, class_="pgx-logo-row"),
+        ui.div(kaptive_logo, kleborate_logo, class_="pgx-logo-row"),
+        class_="pgx-logo-row pgx-logo-row--between",
     ),
     style="margin: 10px auto; width: 100%;",
 )
@@ -68,7 +68,7 @@ home = ui.nav_panel(
         style="margin-top: 20px;",
     ),
     ui.hr(),
-    icon=icon('house')
+    icon=_ICONS['house']
 )
 
 # genotype selector -------------------------------------------------------------
@@ -78,19 +78,22 @@ def _setup_variables(i: str):
 def _setup_filters(i: str):
     id_, label = f'{i}_filter', f'Filter by {i} variable'
     if i == 'temporal':
-        return ui.input_slider(id_, label, min=1900, max=2050, value=(1900, 2050), step=1, time_format="YYYY")
+        return ui.input_slider(id_, label, min=2000, max=2025, value=(2000, 2025), step=1, time_format="YYYY")
     return ui.input_selectize(id_, label, choices=[], multiple=True)
 
+_VARIABLE_WIDGETS = tuple(map(_setup_variables, _VAR_CATEGORIES))
+_FILTER_WIDGETS = tuple(map(_setup_filters, _VAR_CATEGORIES))
+
 # Data filters -----------------------------------------------------------------
 sidebar = ui.sidebar(
     ui.accordion(
         ui.accordion_panel(
-            ui.h5("Variable selector"), *map(_setup_variables, _VAR_CATEGORIES),
-            value="variable_selector", icon=icon("clock")
+            ui.h5("Variable selector"), *_VARIABLE_WIDGETS,
+            value="variable_selector", icon=_ICONS['clock']
         ),
         ui.accordion_panel(
-            ui.h5("Data filters"), *map(_setup_filters, _VAR_CATEGORIES),
-            value="filter_selector", icon=icon("filter")
+            ui.h5("Data filters"), *_FILTER_WIDGETS,
+            value="filter_selector", icon=_ICONS['filter']
         ),
         id="sidebar_accordion",
         multiple=True,
@@ -112,11 +115,14 @@ def _create_flavours(i: tuple[str, list[str]]):
     return ui.input_select(f"{ftype}_flavour", f"{ftype[0].upper()}{ftype[1:]} file flavour", choices=flav,
                            selected=flav[0])
 
+_UPLOAD_WIDGETS = tuple(map(_create_upload, _FLAVOURS))
+_FLAVOUR_WIDGETS = tuple(map(_create_flavours, _FLAVOURS.items()))
+
 upload_panel = ui.accordion_panel(
     ui.h4("Upload files"),
     ui.row(
-        ui.column(4, *map(_create_upload, _FLAVOURS.keys())),
-        ui.column(4, *map(_create_flavours, _FLAVOURS.items())),
+        ui.column(4, *_UPLOAD_WIDGETS),
+        ui.column(4, *_FLAVOUR_WIDGETS),
         ui.column(
             4,
             ui.input_slider("snp_distance", "SNP distance for clustering", min=0, max=100, value=20, step=1),
@@ -125,7 +131,7 @@ upload_panel = ui.accordion_panel(
             ui.hr(),
             ui.input_action_button('upload_reset', 'Reset uploads', class_='btn-danger', width='300px'),
         )
-    ), value='upload_panel', icon=icon('upload'), show=True
+    ), value='upload_panel', icon=_ICONS['upload'], show=True
 )
 prevalence_panel = ui.accordion_panel(
     ui.h4("Total prevalence"),
@@ -135,7 +141,7 @@ prevalence_panel = ui.accordion_panel(
         ui.input_selectize('bars_x', 'Select variable to plot summary bars', choices=[]),
     ),
     output_widget('merged_plot', fill=True),
-    value="prevalence_panel", icon=icon("earth-africa"), show=False
+    value="prevalence_panel", icon=_ICONS['earth-africa'], show=False
 )
 coverage_panel = ui.accordion_panel(
     ui.h4("Spatial coverage"),
@@ -145,12 +151,12 @@ coverage_panel = ui.accordion_panel(
         width=1 / 2,
         # height="400px",
     ),
-    value="coverage_panel", icon=icon("map"), show=False
+    value="coverage_panel", icon=_ICONS['map'], show=False
 )
 dataframe_panel = ui.accordion_panel(
     ui.h4("Table"),
     ui.output_data_frame("dataframe"),
-    value="dataframe_panel", icon=icon("table"), show=False
+    value="dataframe_panel", icon=_ICONS['table'], show=False
 )
 
 # Main panel -------------------------------------------------------------------
@@ -174,7 +180,7 @@ main_panel = ui.nav_panel(
         ui.output_text("summary"),
         ui.accordion(upload_panel, id="accordion", multiple=True),
     ),
-    icon=icon("laptop"),
+    icon=_ICONS['laptop'],
 )
 
 # Define the main UI -----------------------------------------------------------
@@ -182,8 +188,8 @@ main_ui = ui.page_navbar(
     home,
     main_panel,
     ui.nav_spacer(),
-    ui.nav_control(ui.a(icon("github"), href="https://github.com/tomdstanton/pathogenx", target="_blank")),
-    ui.nav_control(ui.a(icon("book"), href="tomdstanton.github.io/pathogenx/", target="_blank")),
+    ui.nav_control(ui.a(_ICONS['github'], href="https://github.com/tomdstanton/pathogenx", target="_blank")),
+    ui.nav_control(ui.a(_ICONS['book'], href="tomdstanton.github.io/pathogenx/", target="_blank")),
     title='PathoGenX 🦠🧬🗺️',
     footer=footer,
     theme=theme.lumen,
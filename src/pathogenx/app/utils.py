@@ -1,11 +1,22 @@
 """
 Module containing generic app utility functions
 """
+from os import environ
+from base64 import b64encode
+from functools import lru_cache
+from mimetypes import guess_type
 from shiny import ui
 from faicons import icon_svg as icon
 from pathlib import Path
 from pathogenx.utils import bold
 
+# Constants ------------------------------------------------------------------------------------------------------------
+_WWW = Path(__file__).parent / "www"
+_INLINE_LOGOS = environ.get("PATHOGENX_INLINE_LOGOS", "0") == "1"  # Off, as the logos are ~370 KB once encoded
+# Icon tags are only serialised, so each SVG is read and parsed once at import and shared by all the UI
+_ICONS = {i: icon(i) for i in ('house', 'clock', 'filter', 'upload', 'earth-africa', 'map', 'table', 'laptop',
+                               'github', 'book', 'gear')}
+
 
 # Functions ------------------------------------------------------------------------------------------------------------
 def dropdown_function(id_, *args) -> ui.Tag:
@@ -19,7 +30,7 @@ def dropdown_function(id_, *args) -> ui.Tag:
         A Shiny UI popover element.
     """
     return ui.popover(
-        ui.input_action_button(id_, "Configure plot", icon=icon("gear")),
+        ui.input_action_button(id_, "Configure plot", icon=_ICONS['gear']),
         *args,
         title="Options",
         placement="bottom"
@@ -72,11 +83,35 @@ def plural_name(name: str, default: str = 's', niceify: bool=False, *args, **kwa
     return name + default
 
 
+@lru_cache
+def _data_uri(src: str) -> str:
+    """Encodes a static asset from the `www` directory as a base64 `data:` URI.
+
+    Args:
+        src (str): The asset file name, relative to the `www` directory.
+
+    Returns:
+        str: The `data:` URI, or `src` unchanged if the asset cannot be read.
+    """
+    path = _WWW / src
+    if not path.is_file():
+        return src
+    mime = guess_type(path.name)[0] or 'application/octet-stream'
+    return f"data:{mime};base64,{b64encode(path.read_bytes()).decode()}"
+
+
+@lru_cache(maxsize=64)
 def create_logo_link(src: str, url: str, width: str, tooltip_text: str | None = None):
     """
     Convenience function for creating a clickable image link that opens in a new tab.
+
+    Tags are cached per set of arguments and shared, so callers must not mutate the returned tag.
+
+    If the `PATHOGENX_INLINE_LOGOS` environment variable is set to "1", the image is embedded as a `data:` URI
+    to save an HTTP request per logo, at the cost of a larger page that the browser cannot cache.
     """
-    link_tag = ui.a(ui.img(src=src, width=width, style="vertical-align: middle;"),
+    img_src = _data_uri(src) if _INLINE_LOGOS else src
+    link_tag = ui.a(ui.img(src=img_src, width=width, style="vertical-align: middle;"),
                     href=f'"https://{url}', target="_blank", id=f'{Path(src).stem}_logo')
     if tooltip_text:
         return ui.tooltip(link_tag, tooltip_text, placement='bottom')
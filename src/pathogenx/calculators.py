@@ -3,15 +3,24 @@ Module for calculating insights from genotyping data such as prevalence.
 """
 
 from abc import ABC, abstractmethod
-from typing import List, Optional, Union
+from collections import OrderedDict
+from hashlib import blake2b
+from functools import cache
+from typing import Callable, List, Optional, Union
 import pandas as pd
 import numpy as np
-from scipy.stats import norm
 
 from pathogenx.dataset import Dataset
 # from .models import ModelResult
 
+
 # Constants ------------------------------------------------------------------------------------------------------------
+_Z = 1.959963984540054  # Z-score for 95% CI, i.e. scipy.stats.norm.ppf(1 - (0.05 / 2))
+_Z2 = _Z * _Z
+_Z2_HALF, _Z2_QUARTER = _Z2 / 2, _Z2 / 4
+_JIT_MIN_SIZE = 10_000  # Below this, thread start-up outweighs the gain over NumPy
+_RESULT_CACHE_SIZE = 32
+_RESULT_CACHE: OrderedDict[tuple, pd.DataFrame] = OrderedDict()  # LRU of result data keyed by data and parameters
 # _ALPHA_DIVERSITY_METRICS = LiteralString['simpson', 'simpson_e', 'simpson_d']
 
 
@@ -58,9 +67,11 @@ class PrevalenceResult(CalculatorResult):
         n_distinct (list[str], optional): List of columns for which distinct counts
             (per-strata) were generated.
         denominator (str, optional): Column indicating the denominator stratum.
+        top_k (int, optional): Number of most prevalent strata kept per denominator
+            group, if the result was truncated.
     """
     def __init__(self, stratified_by: List[str], adjusted_for: List[str] = None, n_distinct: List[str] = None,
-                 denominator: str = None):
+                 denominator: str = None, top_k: int = None):
         """Initializes the PrevalenceResult.
 
         Args:
@@ -70,12 +81,14 @@ class PrevalenceResult(CalculatorResult):
             n_distinct (List[str], optional): Columns distinct counts were generated for.
                 Defaults to None.
             denominator (str, optional): The denominator stratum. Defaults to None.
+            top_k (int, optional): Strata kept per denominator group. Defaults to None.
         """
         super().__init__()
         self.stratified_by: List[str] = stratified_by
         self.adjusted_for: Optional[List[str]] = adjusted_for
         self.n_distinct: Optional[List[str]] = n_distinct
         self.denominator: Optional[str] = denominator
+        self.top_k: Optional[int] = top_k
 
     @classmethod
     def from_calculator(cls, calculator: 'PrevalenceCalculator') -> 'PrevalenceResult':
@@ -88,7 +101,8 @@ class PrevalenceResult(CalculatorResult):
             PrevalenceResult: A new PrevalenceResult object configured with the
                 calculator's parameters.
         """
-        return cls(calculator.stratify_by, calculator.adjust_for, calculator.n_distinct, calculator.denominator)
+        return cls(calculator.stratify_by, calculator.adjust_for, calculator.n_distinct, calculator.denominator,
+                   calculator.top_k)
 
 
 class Calculator(ABC):
@@ -125,9 +139,11 @@ class PrevalenceCalculator(Calculator):
         n_distinct (list[str], optional): List of columns to calculate distinct counts for.
         denominator (str, optional): Column to use as the primary grouping for
             denominators. If None, the first column in stratify_by is used.
+        top_k (int, optional): If set, only the `top_k` most prevalent strata
+            are kept per denominator group.
     """
     def __init__(self, stratify_by: List[str], adjust_for: List[str] = None, n_distinct: List[str] = None,
-                 denominator: str = None):
+                 denominator: str = None, top_k: int = None):
         """Initializes the PrevalenceCalculator.
 
         Args:
@@ -137,14 +153,21 @@ class PrevalenceCalculator(Calculator):
                 Defaults to None.
             denominator (str, optional): Column for primary grouping for denominators.
                 Defaults to None.
+            top_k (int, optional): Number of most prevalent strata to keep per
+                denominator group, ranked by adjusted prevalence if adjusting,
+                otherwise raw. Ranks are then relative to the kept strata.
+                Defaults to None, keeping all strata.
 
         Raises:
-            ValueError: If 'denominator' is provided but not in 'stratify_by'.
+            ValueError: If 'denominator' is provided but not in 'stratify_by',
+                or if 'top_k' is less than 1.
         """
         super().__init__()
 
         if denominator and denominator not in stratify_by:
             raise ValueError("If provided, 'denominator' must be in 'stratify_by'.")
+        if top_k is not None and top_k < 1:
+            raise ValueError("If provided, 'top_k' must be at least 1.")
 
         # Set denominator if not provided and stratification has more than one level
         if not denominator and len(stratify_by) > 1:
@@ -154,6 +177,7 @@ class PrevalenceCalculator(Calculator):
         self.adjust_for: Optional[List[str]] = adjust_for
         self.n_distinct: Optional[List[str]] = n_distinct
         self.denominator: Optional[str] = denominator
+        self.top_k: Optional[int] = top_k
 
     def calculate(self, dataset: Union[Dataset, pd.DataFrame]) -> PrevalenceResult:
         """Calculates prevalence statistics on a dataset.
@@ -176,74 +200,247 @@ class PrevalenceCalculator(Calculator):
             TypeError: If the dataset is not a pandas DataFrame or a
                 pathogenx Dataset object.
         """
+        if not isinstance(dataset, (Dataset, pd.DataFrame)):
+            raise TypeError("dataset must be of type Dataset or pd.DataFrame")
+
+        # Only the columns consumed are read, and only through their factorizations, so the data is never copied
+        columns = list(dict.fromkeys(self.stratify_by + (self.adjust_for or [])[:1] + (self.n_distinct or [])))
         if isinstance(dataset, Dataset):
-            data = dataset.data  # Gets a copy from the @property
-        elif isinstance(dataset, pd.DataFrame):
-            data = dataset.copy()
+            # Datasets keep factorized columns and bump their version whenever a column is recalculated, so they are
+            # keyed without reading any data
+            factorize = dataset.factorize
+            data_key = (id(dataset), dataset.version)
         else:
-            raise TypeError("dataset must be of type Dataset or pd.DataFrame")
+            # DataFrames are keyed on a hash of their factorized columns, which a calculation on a miss then reuses;
+            # the factorizations are memoized as the adjusted column is counted twice
+            factorize = cache(lambda col: pd.factorize(dataset[col]))
+            data_key = _fingerprint([factorize(col) for col in columns])
+
+        # Results are cached on the data and parameters, so repeated calls with unchanged data and parameters
+        # (e.g. Shiny re-evaluating reactives on unrelated inputs) skip the calculation.
+        key = (data_key, tuple(self.stratify_by), tuple(self.adjust_for or ()), tuple(self.n_distinct or ()),
+               self.denominator, self.top_k)
+        if (result_data := _RESULT_CACHE.get(key)) is None:
+            result_data = _RESULT_CACHE[key] = self._calculate(factorize, len(dataset))
+            if len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+                _RESULT_CACHE.popitem(last=False)
+        else:
+            _RESULT_CACHE.move_to_end(key)
+
+        result = PrevalenceResult.from_calculator(self)
+        result.data = result_data  # Set the result data, the getter returns a copy so the cached frame is safe
+        return result
+
+    def _calculate(self, factorize: Callable[[str], tuple[np.ndarray, pd.Index]], n_samples: int) -> pd.DataFrame:
+        """Performs the prevalence calculation for `calculate`.
 
+        Strata, denominators and distinct counts are all computed from integer codes, so each column is only
+        hashed by its factorization.
+
+        Args:
+            factorize (Callable[[str], tuple[np.ndarray, pd.Index]]): Function returning the integer codes and
+                uniques of a column of the data, e.g. `Dataset.factorize`.
+            n_samples (int): The number of samples in the data.
+
+        Returns:
+            pd.DataFrame: The prevalence result data.
+        """
         # 1. Calculate Denominators
-        denominators = {}
         adj_col = self.adjust_for[0] if self.adjust_for else None
+        col_types = ('raw', 'adj') if adj_col else ('raw',)
         if self.denominator:
-            denom_groups = data.groupby(self.denominator)
-            denominators['raw'] = denom_groups.size().rename('denominator.raw')
+            denom_codes, denom_uniques = factorize(self.denominator)
+            denominators = {'denominator.raw': np.bincount(denom_codes[denom_codes >= 0],
+                                                           minlength=len(denom_uniques))}
             if adj_col:
-                denominators['adj'] = denom_groups[adj_col].nunique().rename('denominator.adj')
+                denominators['denominator.adj'] = _count_distinct(denom_codes, factorize(adj_col)[0],
+                                                                  len(denom_uniques))
         else:
-            denominators['raw'] = pd.Series([len(data)], name='denominator.raw')
+            denominators = {'denominator.raw': np.int32(n_samples)}
             if adj_col:
-                denominators['adj'] = pd.Series([data[adj_col].nunique()], name='denominator.adj')
+                # The uniques of the (possibly cached) factorization give the distinct count without another hash pass
+                denominators['denominator.adj'] = np.int32(len(factorize(adj_col)[1]))
 
-        # 2. Calculate Counts within strata
-        strata_groups = data.groupby(self.stratify_by)
-        result_data = strata_groups.size().to_frame('count.raw')
-        if adj_col:
-            result_data['count.adj'] = strata_groups[adj_col].nunique()
-        if self.n_distinct:
-            for col in self.n_distinct:
-                result_data[f'# {col}'] = strata_groups[col].nunique()
-
-        result_data = result_data.reset_index()
-
-        # 3. Join denominators and calculate proportions
+        # 2. Calculate Counts within strata, building the group index once for all counts
+        if len(self.stratify_by) == 1:  # Common case, the codes already number the strata
+            group_ids, strata = factorize(self.stratify_by[0])
+            index = pd.Index(strata, name=self.stratify_by[0])
+        else:
+            levels = [factorize(col) for col in self.stratify_by]
+            group_ids, first = _group_codes([codes for codes, _ in levels])
+            index = pd.MultiIndex(levels=[uniques for _, uniques in levels],
+                                  codes=[codes[first] for codes, _ in levels], names=self.stratify_by,
+                                  verify_integrity=False)
+        counts = {'count.raw': np.bincount(group_ids[group_ids >= 0], minlength=len(index))}
+        distinct = {'count.adj': adj_col} if adj_col else {}
+        distinct |= {f'# {col}': col for col in self.n_distinct or ()}
+        for name, col in distinct.items():
+            counts[name] = _count_distinct(group_ids, factorize(col)[0], len(index))
+        # Counts are bounded by the number of samples, so int32 halves the memory of these and downstream columns.
+        # New columns are collected and the result frame is built once, rather than inserting them one by one.
+        columns = {name: values.astype(np.int32) for name, values in counts.items()}
+
+        # 3. Join denominators, indexing them by the denominator code of each stratum rather than joining columns
         if self.denominator:
-            result_data = result_data.merge(denominators['raw'], on=self.denominator, how='left')
-            if adj_col:
-                result_data = result_data.merge(denominators['adj'], on=self.denominator, how='left')
+            denominator_codes = index.codes[self.stratify_by.index(self.denominator)] if len(self.stratify_by) > 1 \
+                else np.arange(len(index))
+            columns |= {col: values[denominator_codes].astype(np.int32) for col, values in denominators.items()}
         else:
-            result_data['denominator.raw'] = denominators['raw'][0]
-            if adj_col:
-                result_data['denominator.adj'] = denominators['adj'][0]
+            columns |= {col: np.full(len(index), value) for col, value in denominators.items()}
 
         # 4. Calculate Proportions, SE, and CI
-        for col_type in denominators:
-            count = result_data[f'count.{col_type}']
-            denom = result_data[f'denominator.{col_type}']
-            for x, y in zip(('prop', 'se', 'lower', 'upper'), _wilson_score_interval(count, denom)):
-                result_data[f'{x}.{col_type}'] = y
-
-        # 5. Sort data
-        sort_by = ['denominator.adj', 'count.adj'] if self.adjust_for else ['denominator.raw', 'count.raw']
-        result_data = result_data.sort_values(by=sort_by, ascending=False)
+        for col_type in col_types:
+            count = columns[f'count.{col_type}']
+            # Without a denominator stratum the denominator is a scalar that NumPy broadcasts
+            denom = columns[f'denominator.{col_type}'] if self.denominator else denominators[f'denominator.{col_type}']
+            columns |= {f'{x}.{col_type}': y for x, y in
+                        zip(('prop', 'se', 'lower', 'upper'), _wilson_score_interval(count, denom))}
+        result_data = pd.DataFrame(columns, index=index).reset_index()
+
+        # 5. Sort data, keeping only the most prevalent strata per group if requested
+        sort_type = col_types[-1]
+        if self.top_k is not None:
+            result_data = result_data.iloc[_top_k_indices(result_data, f'count.{sort_type}', self.top_k,
+                                                          self.denominator)]
+        result_data = result_data.sort_values(by=[f'denominator.{sort_type}', f'count.{sort_type}'], ascending=False,
+                                              kind='stable', ignore_index=True)
 
         # 6. Calculate Ranks
-        rank_groups = result_data.groupby(self.denominator) if self.denominator else result_data
-        for col_type in denominators:
-            result_data[f'rank.{col_type}'] = rank_groups[f'prop.{col_type}'].rank(method='first', ascending=False)
+        # Denominators are constant within a group, so the sort above already orders each group by descending
+        # proportion and ranks are the cumulative count; other proportions need sorting first.
+        ranks = {}
+        for col_type in col_types:
+            ordered = result_data if col_type == sort_type else result_data.sort_values(
+                f'prop.{col_type}', ascending=False, kind='stable')
+            if self.denominator:
+                rank = ordered.groupby(self.denominator, sort=False, observed=True).cumcount()
+            else:
+                rank = pd.Series(np.arange(len(ordered)), index=ordered.index)
+            ranks[f'rank.{col_type}'] = (rank + 1).astype(np.int32)
 
-        result = PrevalenceResult.from_calculator(self)
-        result.data = result_data  # Set the result data
-        return result
+        return result_data.assign(**ranks)
 
 
 # Functions ------------------------------------------------------------------------------------------------------------
+def _top_k_indices(data: pd.DataFrame, column: str, k: int, group_by: str = None) -> np.ndarray:
+    """Finds the positions of the rows with the `k` largest values of a column, per group.
+
+    Uses `np.argpartition`, so selection is linear in the group size rather than requiring a full sort. Ties at the
+    k-th value are broken arbitrarily.
+
+    Args:
+        data (pd.DataFrame): The data to select from.
+        column (str): The column to select the largest values of.
+        k (int): The number of rows to keep per group.
+        group_by (str, optional): Column to group by. Defaults to None, treating the data as a single group.
+
+    Returns:
+        np.ndarray: The sorted integer positions of the selected rows.
+    """
+    values = data[column].to_numpy()
+    groups = (data.groupby(group_by, sort=False, observed=True).indices.values() if group_by
+              else [np.arange(len(data))])
+    keep = [idx if len(idx) <= k else idx[np.argpartition(-values[idx], k - 1)[:k]] for idx in groups]
+    return np.sort(np.concatenate(keep)) if keep else np.array([], dtype=np.intp)
+
+
+def _fingerprint(factorized: list[tuple[np.ndarray, pd.Index]]) -> bytes:
+    """Computes a content hash of factorized columns.
+
+    Columns are hashed from their integer codes and uniques, so each distinct value is hashed once rather than
+    once per row.
+
+    Args:
+        factorized (list[tuple[np.ndarray, pd.Index]]): The codes and uniques of each column, as from `pd.factorize`.
+
+    Returns:
+        bytes: A 16-byte digest of the values.
+    """
+    h = blake2b(digest_size=16)
+    for codes, uniques in factorized:
+        h.update(codes.tobytes())
+        h.update(pd.util.hash_pandas_object(uniques).to_numpy().tobytes())
+    return h.digest()
+
+
+def _group_codes(codes: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Numbers the distinct combinations of several factorized columns, in order of first appearance.
+
+    Equivalent to `groupby(..., sort=False).ngroup()`, but each pair of columns is packed into single integers and
+    re-factorized, so only integers are hashed.
+
+    Args:
+        codes (list[np.ndarray]): The factorized values of each column, negative for missing values.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The group number of each row, -1 if any of its values are missing, and the
+            position of the first row of each group.
+    """
+    group_ids = codes[0]
+    for col_codes in codes[1:]:
+        mask = (group_ids >= 0) & (col_codes >= 0)
+        packed = group_ids[mask].astype(np.int64) * (int(col_codes.max(initial=0)) + 1) + col_codes[mask]
+        group_ids = np.full(len(col_codes), -1, dtype=np.intp)
+        group_ids[mask] = pd.factorize(packed)[0]
+    # Groups are numbered in order of appearance, so a group starts wherever the running maximum increases
+    running = np.maximum.accumulate(group_ids)
+    return group_ids, np.flatnonzero(np.diff(running, prepend=-1) > 0)
+
+
+def _count_distinct(group_ids: np.ndarray, codes: np.ndarray, n_groups: int) -> np.ndarray:
+    """Counts the distinct values within groups from integer codes.
+
+    Equivalent to `groupby(...)[col].nunique()` given the group number and factorized value of each row, but
+    (group, value) pairs are packed into single integers so they can be de-duplicated in one vectorised pass
+    without building another group index.
+
+    Args:
+        group_ids (np.ndarray): The group number of each row, negative if the row is not in a group.
+        codes (np.ndarray): The factorized value of each row, negative for missing values.
+        n_groups (int): The number of groups.
+
+    Returns:
+        np.ndarray: The number of distinct values in each group.
+    """
+    mask = (group_ids >= 0) & (codes >= 0)
+    n_values = int(codes.max()) + 1 if mask.any() else 1
+    # Hash-based, so linear in the number of rows, where np.unique would sort them
+    pairs = pd.unique(group_ids[mask].astype(np.int64) * n_values + codes[mask])
+    return np.bincount(pairs // n_values, minlength=n_groups)
+
+
+@cache
+def _wilson_kernel() -> Callable:
+    """Compiles the Numba kernel for `_wilson_score_interval` on first use, so numba is only imported if needed."""
+    from numba import njit, prange
+
+    @njit(parallel=True)  # Not cached on disk, which would write into the installed package
+    def kernel(counts: np.ndarray, denominators: np.ndarray, prop: np.ndarray, se: np.ndarray, lower: np.ndarray,
+               upper: np.ndarray):
+        """Fills the output arrays of `_wilson_score_interval` in place in a single pass."""
+        for i in prange(counts.shape[0]):
+            n = denominators[i]
+            p = counts[i] / n
+            pq = p * (1.0 - p)
+            dz = n + _Z2
+            center = (counts[i] + _Z2_HALF) / dz
+            width = (_Z / dz) * np.sqrt(pq * n + _Z2_QUARTER)
+            prop[i] = p
+            se[i] = np.sqrt(pq / n)
+            lower[i] = center - width
+            upper[i] = center + width
+
+    return kernel
+
+
 def _wilson_score_interval(counts: np.ndarray, denominators: np.ndarray) -> tuple[float, float, float, float]:
     """Calculates the Wilson score interval for a proportion.
 
     Also returns the simple proportion and standard error (using Wald method)
-    for reporting alongside the more robust Wilson interval.
+    for reporting alongside the more robust Wilson interval. Results are
+    float32 if both inputs are 32-bit or narrower, otherwise float64.
+    Counts are assumed not to exceed their denominators, as is the case
+    for counts within strata of the denominator.
 
     Args:
         counts (np.ndarray): The number of successes (numerator).
@@ -253,15 +450,34 @@ def _wilson_score_interval(counts: np.ndarray, denominators: np.ndarray) -> tupl
         tuple[float, float, float, float]: A tuple containing the proportion,
             standard error, lower bound of the CI, and upper bound of the CI.
     """
-    prop = (counts / denominators).clip(0, 1)
-    # Use the more robust Wilson score interval for CI
-    z = norm.ppf(1 - (0.05 / 2))  # Z-score for 95% CI
+    dtype = np.float32 if np.result_type(counts, denominators).itemsize <= 4 else np.float64
+    counts, denominators = np.broadcast_arrays(np.asarray(counts, dtype=dtype), np.asarray(denominators, dtype=dtype))
+    # Imported here, as building `RESOURCES` imports the app and in turn this module
+    from pathogenx import RESOURCES
+    if counts.size >= _JIT_MIN_SIZE and 'numba' in RESOURCES.optional_packages:
+        counts, denominators = np.ascontiguousarray(counts).ravel(), np.ascontiguousarray(denominators).ravel()
+        prop, se, lower, upper = out = np.empty((4, counts.size), dtype=dtype)
+        _wilson_kernel()(counts, denominators, *out)
+        return prop, se, lower, upper
+    # Each intermediate is computed in place where possible to limit temporary arrays
+    prop = np.divide(counts, denominators)  # Counts never exceed their denominators, so no clipping is needed
+    pq = np.subtract(1, prop)
+    pq *= prop
     # Calculate standard error using the Wald method for reporting
-    se = np.sqrt(prop * (1 - prop) / denominators)
-    # Wilson score interval calculation
-    center = (counts + z ** 2 / 2) / (denominators + z ** 2)
-    width = (z / (denominators + z ** 2)) * np.sqrt((prop * (1 - prop) * denominators) + (z ** 2 / 4))
-    return prop, se, center - width, center + width
+    se = np.divide(pq, denominators)
+    np.sqrt(se, out=se)
+    # Use the more robust Wilson score interval for CI
+    dz = denominators + _Z2
+    width = np.multiply(pq, denominators, out=pq)
+    width += _Z2_QUARTER
+    np.sqrt(width, out=width)
+    width *= _Z
+    width /= dz
+    lower = np.add(counts, _Z2_HALF)  # Interval centre, then shifted down by the width
+    lower /= dz
+    upper = lower + width
+    lower -= width
+    return prop, se, lower, upper
 
 
 def _calculate_ci(samples: np.ndarray, prob: float = 0.95) -> tuple[np.ndarray, np.ndarray]:
@@ -279,5 +495,7 @@ def _calculate_ci(samples: np.ndarray, prob: float = 0.95) -> tuple[np.ndarray,
     lower_q = (1 - prob) / 2
     upper_q = 1 - lower_q
     # Quantiles are calculated over the flattened chain/draw dimensions
-    flat_samples = samples.reshape(-1, samples.shape[-1]) if samples.ndim > 1 else samples.flatten()
-    return np.quantile(flat_samples, lower_q, axis=0), np.quantile(flat_samples, upper_q, axis=0)
+    flat_samples = samples.reshape(-1, samples.shape[-1]) if samples.ndim > 1 else samples
+    # Both bounds in one call so the samples are only partitioned once
+    lower, upper = np.quantile(flat_samples, (lower_q, upper_q), axis=0, method='linear')
+    return lower, upper
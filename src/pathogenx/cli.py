@@ -40,6 +40,8 @@ def prevalence_parser(subparsers):
     inputs.add_argument('--distance-flavour', help='Distance file flavour (default: %(default)s)\n'
                                                    '(choices: %(choices)s)', metavar='',
                         choices=get_args(_DIST_FLAVOURS), default='pw-dist')
+    inputs.add_argument('--cache-distances', action='store_true',
+                        help='Cache the parsed distance file on disk to speed up reloading it')
 
     calc = parser.add_argument_group(bold('Calculator options'), '')
     calc.add_argument('--adjust-for', help='Optional list of columns for adjustment (e.g., Cluster)', nargs='*', metavar='')
@@ -92,7 +94,7 @@ def main():
         if args.metadata is not None:
             metadata_file = MetaFile.from_flavour(args.metadata, args.metadata_flavour)
         if args.distances is not None:
-            distance_file = DistFile.from_flavour(args.distances, args.distance_flavour)
+            distance_file = DistFile.from_flavour(args.distances, args.distance_flavour, cache=args.cache_distances)
 
         dataset = Dataset.from_files(genotype_file, metadata_file, distance_file)
         if dataset.distances is not None:
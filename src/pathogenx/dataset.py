@@ -1,16 +1,22 @@
+from itertools import count
 from pathlib import Path
 from typing import Literal
-from re import compile as regex
+from re import compile as regex, ASCII
 from warnings import warn
 
+import numpy as np
 import pandas as pd
 from scipy.sparse import coo_matrix
 from scipy.sparse.csgraph import connected_components
 
 from pathogenx import PathogenxWarning
-from pathogenx.utils import grouper
 from pathogenx.io import GenotypeFile, MetaFile, DistFile
 
+# Constants ------------------------------------------------------------------------------------------------------------
+_VERSIONS = count()  # Shared by all datasets, so a version also tells datasets apart
+_PATHOGENWATCH_REGEX = regex(r'.*pathogenwatch-(?P<species>\w+)-(?P<collection>[\w-]+)-'
+                             r'(?P<analysis>(kleborate|difference-matrix|metadata))\.csv', ASCII)
+
 
 # Classes --------------------------------------------------------------------------------------------------------------
 class DatasetError(Exception):
@@ -35,6 +41,8 @@ class Dataset:
         distances (coo_matrix | None): Sparse distance matrix, if provided.
         genotype_columns (set[str]): Names of columns containing genotype data.
         metadata_columns (set[str]): Names of columns containing metadata.
+        version (int): Identifies the current state of the data, changing whenever a column is recalculated.
+        _codes (dict[str, tuple[np.ndarray, pd.Index]]): Factorized columns, populated on demand by `factorize`.
     """
     def __init__(self, genotypes: pd.DataFrame, metadata: pd.DataFrame = None,
                  distances: tuple[coo_matrix, list[str]] = None, name: str = 'unknown',
@@ -48,9 +56,9 @@ class Dataset:
         # Add distances ------------------------------------------------------------------
         if distances is not None:
             distances, index = distances  # Unpack tuple
-            for sample in self._data.index:  # Check all samples are present in data
-                if sample not in index:
-                    raise DatasetError(f'Sample {sample} not in index')
+            if len(missing := self._data.index.difference(index)) > 0:  # Check all samples are present in data
+                raise DatasetError(f'{len(missing)} samples not in distance index, '
+                                   f'e.g. {", ".join(map(str, missing[:5]))}')
             self._data = self._data.reindex(index)  # Reorder index to match distance matrix
             self.distances = distances.tocsr()  # Convert to CSR for efficient row slicing
         else:
@@ -59,6 +67,8 @@ class Dataset:
         self.metadata_columns: set[str] = metadata_columns or (set(metadata.columns) if metadata is not None else set())
         self.metadata_columns.add('Dataset')
         self.genotype_columns: set[str] = (genotype_columns or set(genotypes.columns)) - self.metadata_columns
+        self._codes: dict[str, tuple[np.ndarray, pd.Index]] = {}
+        self.version: int = next(_VERSIONS)
 
     def __repr__(self) -> str:
         return (f'Dataset({len(self._data)} samples {"with" if self.distances is not None else "without"} distances, '
@@ -75,7 +85,8 @@ class Dataset:
         return self._data[item]
 
     def __iter__(self):
-        return self._data.itertuples()
+        """Iterates over samples as plain tuples of the sample name followed by the column values."""
+        return self._data.itertuples(name=None)
 
     @classmethod
     def from_files(cls, genotypes: GenotypeFile, metadata: MetaFile = None, distances: DistFile = None, name: str = None):
@@ -100,7 +111,7 @@ class Dataset:
         )
 
     @classmethod
-    def from_pathogenwatch(cls, path: Path) -> 'Dataset':
+    def from_pathogenwatch(cls, path: Path, cache: bool = False) -> 'Dataset':
         """
         Initialises a `Dataset` instance from a Pathogenwatch folder.
 
@@ -111,6 +122,8 @@ class Dataset:
 
         Parameters:
             path (Path): The path to the directory containing Pathogenwatch CSV files.
+            cache (bool, optional): Whether to cache the parsed difference matrix on disk, so reloading an unchanged
+                folder skips parsing it. Defaults to False.
 
         Returns:
             Dataset: A new `Dataset` instance populated with data from the Pathogenwatch files.
@@ -118,14 +131,14 @@ class Dataset:
         Raises:
             DatasetError: If no relevant Pathogenwatch files are found or if genotype data is missing.
         """
-        r = regex(r'.*pathogenwatch-(?P<species>\w+)-(?P<collection>[\w-]+)-'
-                  r'(?P<analysis>(kleborate|difference-matrix|metadata))\.csv')
-        if not (files := [match for file in path.glob('*.csv') if (match := r.match(file.name))]):
+        datasets = {}  # Files of each analysis, keyed by (species, collection), in a single pass over the folder
+        for file in sorted(path.glob('*.csv')):
+            if match := _PATHOGENWATCH_REGEX.match(file.name):
+                datasets.setdefault((match['species'], match['collection']), {}).setdefault(match['analysis'], file)
+        if not datasets:
             raise DatasetError(f'Could not find any files in {path}')
 
-        dataset, files = next(grouper(files, 2))
-
-        files = {k: path / next(v).string for k, v in grouper(files, 3)}
+        (_, dataset), files = next(iter(datasets.items()))
         genotypes, metadata, distances = files.get('kleborate'), files.get('metadata'), files.get('difference-matrix')
         if genotypes is None:
             raise DatasetError(f'Could not find any genotypes in {path} for {dataset}')
@@ -133,7 +146,7 @@ class Dataset:
         return cls.from_files(
             GenotypeFile.from_flavour(genotypes, 'pw-kleborate'),
             MetaFile.from_flavour(metadata, 'pw-metadata') if metadata else None,
-            DistFile.from_flavour(distances, 'pw-dist') if distances else None,
+            DistFile.from_flavour(distances, 'pw-dist', cache=cache) if distances else None,
             dataset
         )
 
@@ -148,6 +161,20 @@ class Dataset:
         """Returns a list of sample names (the index of the internal DataFrame)."""
         return self._data.index
 
+    def factorize(self, column: str) -> tuple[np.ndarray, pd.Index]:
+        """Encodes a column as integer codes, caching the result for reuse across calculations.
+
+        Args:
+            column (str): The name of the column to factorize.
+
+        Returns:
+            tuple[np.ndarray, pd.Index]: The codes (-1 for missing values) and the unique values they refer to,
+                in order of appearance.
+        """
+        if (codes := self._codes.get(column)) is None:
+            codes = self._codes[column] = pd.factorize(self._data[column])
+        return codes
+
     def calculate_clusters(self, method: Literal['connected_components', 'variables'] = 'connected_components',
                            group_by: list[str] = None, distance: int = 20) -> pd.Series:
         """Calculates clusters and adds/overwrites the 'Cluster' column.
@@ -183,16 +210,23 @@ class Dataset:
         """
         if 'Cluster' in self._data.columns:
             warn("'Cluster' column already exists and will be overwritten.", DatasetWarning)
+        self._codes.pop('Cluster', None)
+        self.version = next(_VERSIONS)
 
         if method == 'variables':
             self._data['Cluster'] = 'cluster_' + (self._data.groupby(group_by).ngroup() + 1).astype(str) \
-                if group_by else [f'cluster_{i + 1}' for i in range(len(self._data))]
+                if group_by else np.char.add('cluster_', np.arange(1, len(self._data) + 1).astype(str))
 
         elif method == 'connected_components':
             if self.distances is None:
                 raise DatasetError("Cannot calculate connected components: no distance matrix found in Dataset.")
 
-            cluster_labels = pd.Series(index=self._data.index, dtype='object')
+            # Threshold the whole graph once, so each group's subgraph is sliced from the (much sparser) edges left
+            graph = self.distances.copy()
+            graph.data[graph.data > distance] = 0
+            graph.eliminate_zeros()
+
+            cluster_ids = np.zeros(len(self._data), dtype=np.int64)  # 0 for samples not in any group
             global_cluster_counter = 1
 
             # Determine groups: either from group_by or a single group for the whole dataset
@@ -205,18 +239,24 @@ class Dataset:
                 # Get integer indices for samples in this group
                 group_indices = self._data.index.get_indexer(group_df.index)
 
-                # Efficiently subset the sparse graph and filter by distance
-                subgraph = self.distances[group_indices, :][:, group_indices]
-                subgraph.data[subgraph.data > distance] = 0
-                subgraph.eliminate_zeros()
-
-                _, local_labels = connected_components(csgraph=subgraph, directed=False, return_labels=True)
+                if len(group_indices) == 1:  # A singleton is its own cluster, no need to slice the graph
+                    local_labels = np.zeros(1, dtype=np.int64)
+                else:
+                    # Efficiently subset the sparse graph, rows from the CSR structure first; without groups the
+                    # thresholded graph already is the subgraph
+                    subgraph = graph[group_indices][:, group_indices] if group_by else graph
+                    if subgraph.nnz == 0:  # Every sample is its own component, skipping the csgraph set-up cost
+                        local_labels = np.arange(len(group_indices))
+                    else:
+                        _, local_labels = connected_components(csgraph=subgraph, directed=False, return_labels=True)
 
                 if local_labels.size > 0:
-                    cluster_labels.loc[group_df.index] = [f"cluster_{l + global_cluster_counter}" for l in local_labels]
+                    cluster_ids[group_indices] = local_labels + global_cluster_counter
                     global_cluster_counter += local_labels.max() + 1
 
-            self._data['Cluster'] = cluster_labels
+            # Format all labels at once, leaving samples outside any group missing
+            cluster_labels = pd.Series(np.char.add('cluster_', cluster_ids.astype(str)), index=self._data.index)
+            self._data['Cluster'] = cluster_labels.where(cluster_ids > 0)
 
         else:
             raise ValueError(f"Unknown method: {method}")
@@ -1,17 +1,39 @@
 """
 Module to read and parse genotype, metadata and distance data from different sources
 """
+from csv import reader
+from hashlib import blake2b
+from os import environ, replace
 from pathlib import Path
+from tempfile import NamedTemporaryFile
 from typing import Union, Literal
+from warnings import warn
+from zipfile import BadZipFile
 from abc import ABC, abstractmethod
+import numpy as np
 import pandas as pd
-from scipy.sparse import coo_matrix
+from numpy.typing import DTypeLike
+from scipy.sparse import coo_matrix, csr_matrix, spmatrix
+
+from pathogenx import PathogenxWarning
 
 
 # Constants ------------------------------------------------------------------------------------------------------------
 _GENOTYPE_FLAVOURS = Literal['pw-kleborate', 'kleborate', 'kaptive']
 _META_FLAVOURS = Literal['pw-metadata']
 _DIST_FLAVOURS = Literal['pw-dist', 'mash', 'ska1', 'ska2']
+# Constructor arguments for each flavour
+_GENOTYPE_FLAVOUR_PARAMS = {'pw-kleborate': {'sep': ',', 'index_col': 1}, 'kleborate': {}, 'kaptive': {}}
+_META_FLAVOUR_PARAMS = {'pw-metadata': {'sep': ','}}
+_DIST_FLAVOUR_PARAMS = {
+    'pw-dist': {'shape': 'square', 'sep': ',', 'symmetrical': True},
+    'mash': {'shape': 'long', 'usecols': (0, 1, 3), 'sep': '\t'},
+    'ska1': {'shape': 'long', 'usecols': (0, 1, 6), 'sep': '\t'},
+    'ska2': {'shape': 'long', 'usecols': (0, 1, 2), 'sep': '\t'},
+}
+_ENGINES = Literal['pyarrow', 'c', 'python']
+_CHUNK_SIZE = 1 << 20  # Rows per chunk when streaming long distance files
+_ARROW_BLOCK_SIZE = 8 << 20  # Bytes per block parsed by each PyArrow thread, wide enough for whole matrix rows
 
 
 # Classes --------------------------------------------------------------------------------------------------------------
@@ -29,7 +51,7 @@ class _InputFile(ABC):
         self.name = name or self.filepath.stem
 
     @abstractmethod
-    def load(self) -> Union[pd.DataFrame, tuple[coo_matrix, list[str]]]:
+    def load(self) -> Union[pd.DataFrame, tuple[spmatrix, list[str]]]:
         """Abstract method to load the file content."""
         pass
 
@@ -37,20 +59,41 @@ class _InputFile(ABC):
         """Return a string representation of the object."""
         return f"{self.__class__.__name__}('{self.name}')"
 
+    def _cache_path(self, *params) -> Path:
+        """Returns the path to the on-disk cache of the parsed file.
+
+        The name is a key of the resolved path, followed by a key of the modification time and size of the file, so
+        an edited file misses the cache, and any loading parameters that change the parsed result. Entries for the
+        same file share the first key, so stale ones can be found and evicted.
+
+        Args:
+            *params: Loading parameters to include in the key.
+
+        Returns:
+            Path: The cache file path, which may not exist yet.
+        """
+        stat = self.filepath.stat()
+        path_key = blake2b(str(self.filepath.resolve()).encode(), digest_size=8).hexdigest()
+        key = repr((stat.st_mtime_ns, stat.st_size, self.__class__.__name__, *params))
+        return _cache_dir() / f'{path_key}-{blake2b(key.encode(), digest_size=8).hexdigest()}.npz'
+
 
 class _BaseTextFile(_InputFile):
     """Base class for delimited text files that can be loaded into a DataFrame."""
-    def __init__(self, filepath: Union[Path, str], sep: str = '\t', index_col: int = 0):
+    def __init__(self, filepath: Union[Path, str], sep: str = '\t', index_col: int = 0, engine: _ENGINES = 'c'):
         """Initializes the _BaseTextFile.
 
         Args:
             filepath (Union[Path, str]): The path to the input file.
             sep (str, optional): The separator used in the file. Defaults to '\t'.
             index_col (int, optional): The column to use as the index. Defaults to 0.
+            engine (_ENGINES, optional): The parser engine passed to `pd.read_csv`. Defaults to 'c', as the
+                'pyarrow' engine parses date-like columns as timestamps.
         """
         super().__init__(filepath=filepath)
         self.index_col = index_col
         self.sep = sep
+        self.engine = engine
 
     def load(self) -> pd.DataFrame:
         """Loads the text file into a pandas DataFrame.
@@ -58,28 +101,31 @@ class _BaseTextFile(_InputFile):
         Returns:
             pd.DataFrame: The loaded data.
         """
-        return pd.read_table(self.filepath, sep=self.sep, index_col=self.index_col)
+        return _read_table(self.filepath, sep=self.sep, engine=self.engine, index_col=self.index_col)
 
 
 class GenotypeFile(_BaseTextFile):
     """Represents a genotype file."""
-    def __init__(self, filepath: Union[Path, str], sep: str = '\t', index_col: int = 0):
+    def __init__(self, filepath: Union[Path, str], sep: str = '\t', index_col: int = 0, engine: _ENGINES = 'c'):
         """Initializes the GenotypeFile.
 
         Args:
             filepath (Union[Path, str]): The path to the genotype file.
             sep (str, optional): The separator used in the file. Defaults to '\t'.
             index_col (int, optional): The column to use as the index. Defaults to 0.
+            engine (_ENGINES, optional): The parser engine passed to `pd.read_csv`. Defaults to 'c', as the
+                'pyarrow' engine parses date-like columns as timestamps.
         """
-        super().__init__(filepath=filepath, sep=sep, index_col=index_col)
+        super().__init__(filepath=filepath, sep=sep, index_col=index_col, engine=engine)
 
     @classmethod
-    def from_flavour(cls, filepath: Union[Path, str], flavour: _GENOTYPE_FLAVOURS) -> 'GenotypeFile':
+    def from_flavour(cls, filepath: Union[Path, str], flavour: _GENOTYPE_FLAVOURS, **kwargs) -> 'GenotypeFile':
         """Creates a GenotypeFile instance from a specific file format flavour.
 
         Args:
             filepath (Union[Path, str]): The path to the genotype file.
             flavour (_GENOTYPE_FLAVOURS): The format of the file.
+            **kwargs: Further keyword arguments passed to the constructor, e.g. `engine='pyarrow'`.
 
         Returns:
             GenotypeFile: An instance of GenotypeFile with appropriate settings.
@@ -87,34 +133,33 @@ class GenotypeFile(_BaseTextFile):
         Raises:
             ValueError: If the flavour is unknown.
         """
-        if flavour in {'kleborate', 'kaptive'}:
-            self = cls(filepath)
-        elif flavour == 'pw-kleborate':
-            self = cls(filepath, sep=',', index_col=1)
-        else:
+        if (params := _GENOTYPE_FLAVOUR_PARAMS.get(flavour)) is None:
             raise ValueError(f"Unknown flavour: {flavour}")
-        return self
+        return cls(filepath, **params | kwargs)
 
 
 class MetaFile(_BaseTextFile):
     """Represents a metadata file."""
-    def __init__(self, filepath: Union[Path, str], sep: str = '\t', index_col: int = 0):
+    def __init__(self, filepath: Union[Path, str], sep: str = '\t', index_col: int = 0, engine: _ENGINES = 'c'):
         """Initializes the MetaFile.
 
         Args:
             filepath (Union[Path, str]): The path to the metadata file.
             sep (str, optional): The separator used in the file. Defaults to '\t'.
             index_col (int, optional): The column to use as the index. Defaults to 0.
+            engine (_ENGINES, optional): The parser engine passed to `pd.read_csv`. Defaults to 'c', as the
+                'pyarrow' engine parses date-like columns as timestamps.
         """
-        super().__init__(filepath=filepath, sep=sep, index_col=index_col)
+        super().__init__(filepath=filepath, sep=sep, index_col=index_col, engine=engine)
 
     @classmethod
-    def from_flavour(cls, filepath: Union[Path, str], flavour: _META_FLAVOURS) -> 'MetaFile':
+    def from_flavour(cls, filepath: Union[Path, str], flavour: _META_FLAVOURS, **kwargs) -> 'MetaFile':
         """Creates a MetaFile instance from a specific file format flavour.
 
         Args:
             filepath (Union[Path, str]): The path to the metadata file.
             flavour (_META_FLAVOURS): The format of the file.
+            **kwargs: Further keyword arguments passed to the constructor, e.g. `engine='pyarrow'`.
 
         Returns:
             MetaFile: An instance of MetaFile with appropriate settings.
@@ -122,17 +167,16 @@ class MetaFile(_BaseTextFile):
         Raises:
             ValueError: If the flavour is unknown.
         """
-        if flavour == 'pw-metadata':
-            self = cls(filepath, sep=',')
-        else:
+        if (params := _META_FLAVOUR_PARAMS.get(flavour)) is None:
             raise ValueError(f"Unknown flavour: {flavour}")
-        return self
+        return cls(filepath, **params | kwargs)
 
 
 class DistFile(_InputFile):
     """Represents a distance matrix file."""
     def __init__(self, filepath: Union[Path, str], shape: Literal['square', 'long'] = 'long',
-                 sep: str = '\t', usecols: tuple[int, int, int] = (0, 1, 2), symmetrical: bool = True):
+                 sep: str = '\t', usecols: tuple[int, int, int] = (0, 1, 2), symmetrical: bool = True,
+                 engine: _ENGINES = None, cache: bool = False, dtype: DTypeLike = np.float32):
         """Initializes the DistFile.
 
         Args:
@@ -143,48 +187,80 @@ class DistFile(_InputFile):
             usecols (tuple[int, int, int], optional): The columns to use for long format
                 (sample1, sample2, distance). Defaults to (0, 1, 2).
             symmetrical (bool, optional): Whether a square matrix is symmetrical. Defaults to True.
+            engine (_ENGINES, optional): The parser engine passed to `pd.read_csv`. Defaults to 'pyarrow' if
+                installed, otherwise 'c'.
+            cache (bool, optional): Whether to cache the parsed matrix on disk (under `$XDG_CACHE_HOME/pathogenx`),
+                so reloading an unchanged file skips parsing. Defaults to False.
+            dtype (DTypeLike, optional): The dtype of the distances. Defaults to float32, which is exact for SNP
+                distances up to 2**24 and halves the memory of float64.
         """
         super().__init__(filepath=filepath)
         self.shape = shape
         self.sep = sep
         self.usecols = usecols
         self.symmetrical = symmetrical
+        self.engine = engine
+        self.cache = cache
+        self.dtype = dtype
 
-    def load(self) -> tuple[coo_matrix, list[str]]:
+    def load(self) -> tuple[spmatrix, list[str]]:
         """Loads a distance matrix into a sparse matrix format.
 
         Returns:
-            tuple[coo_matrix, list[str]]: A tuple containing the sparse distance
+            tuple[spmatrix, list[str]]: A tuple containing the sparse distance
             matrix and a list of sample names.
 
         Raises:
             ValueError: If the shape is unknown.
         """
+        if self.cache:
+            cache_path = self._cache_path(self.shape, self.sep, tuple(self.usecols), self.symmetrical,
+                                          np.dtype(self.dtype).str)
+            if cache_path.exists():
+                try:
+                    with np.load(cache_path) as cached:
+                        matrix = csr_matrix((cached['data'], cached['indices'], cached['indptr']),
+                                            shape=tuple(cached['shape']))
+                        return matrix, cached['names'].tolist()
+                except (OSError, EOFError, ValueError, KeyError, BadZipFile) as e:  # Corrupt, so parse the file
+                    warn(f'Ignoring unreadable distance cache {cache_path}: {e}', PathogenxWarning)
+
         if self.shape == 'square':
-            df = pd.read_table(self.filepath, sep=self.sep, index_col=0)
-            matrix = coo_matrix(df.values)  # Convert the pandas DataFrame to a scipy sparse COO matrix
-            if not self.symmetrical:
-                matrix = matrix.maximum(matrix.T)
-            return matrix, df.columns.tolist()
+            matrix, names = _load_distance_square(self.filepath, self.sep, self.symmetrical, self.engine, self.dtype)
         elif self.shape == 'long':
-            df = pd.read_table(self.filepath, sep=self.sep, usecols=self.usecols, header=None)
-            index = {sample: i for i, sample in enumerate(pd.unique(df.iloc[:, [0, 1]].values.ravel('K')))}
-            num_samples = len(index)
-            rows = df.iloc[:, 0].map(index).values
-            columns = df.iloc[:, 1].map(index).values
-            data = df.iloc[:, 2].values
-            matrix = coo_matrix((data, (rows, columns)), shape=(num_samples, num_samples))
-            return matrix, list(index.keys())
+            matrix, names = _load_distance_long(self.filepath, self.sep, self.usecols, self.engine, self.dtype)
         else:
             raise ValueError(f"Unknown shape: {self.shape}")
 
+        if self.cache and (cached_names := np.asarray(names)).dtype.kind in 'UiuSf':  # Object arrays need pickling
+            cached, partial = matrix.tocsr(), None
+            try:  # The cache is an optimisation, so failing to write it must not fail the load
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                # Written to a uniquely named file and moved into place, so concurrent loads never read or clobber a
+                # half-written cache
+                with NamedTemporaryFile(dir=cache_path.parent, suffix='.partial', delete=False) as f:
+                    partial = f.name
+                    np.savez(f, data=cached.data, indices=cached.indices, indptr=cached.indptr,
+                             shape=np.asarray(cached.shape), names=cached_names)
+                replace(partial, cache_path)
+                # Entries can be GBs, so only the latest for each file is kept
+                for stale in cache_path.parent.glob(f'{cache_path.stem.partition("-")[0]}-*.npz'):
+                    if stale != cache_path:
+                        stale.unlink(missing_ok=True)
+            except OSError as e:
+                warn(f'Could not write distance cache {cache_path}: {e}', PathogenxWarning)
+                if partial is not None:
+                    Path(partial).unlink(missing_ok=True)
+        return matrix, names
+
     @classmethod
-    def from_flavour(cls, filepath: Union[Path, str], flavour: _DIST_FLAVOURS) -> 'DistFile':
+    def from_flavour(cls, filepath: Union[Path, str], flavour: _DIST_FLAVOURS, **kwargs) -> 'DistFile':
         """Creates a DistFile instance from a specific file format flavour.
 
         Args:
             filepath (Union[Path, str]): The path to the distance matrix file.
             flavour (_DIST_FLAVOURS): The format of the file.
+            **kwargs: Further keyword arguments passed to the constructor, e.g. `cache`.
 
         Returns:
             DistFile: An instance of DistFile with appropriate settings.
@@ -192,14 +268,169 @@ class DistFile(_InputFile):
         Raises:
             ValueError: If the flavour is unknown.
         """
-        if flavour == 'mash':
-            self = cls(filepath, shape='long', usecols=(0, 1, 3), sep='\t')
-        elif flavour == 'ska1':
-            self = cls(filepath, shape='long', usecols=(0, 1, 6), sep='\t')
-        elif flavour == 'ska1':
-            self = cls(filepath, shape='long', usecols=(0, 1, 2), sep='\t')
-        elif flavour == 'pw-dist':
-            self = cls(filepath, shape='square', sep=',', symmetrical=True)
-        else:
+        if (params := _DIST_FLAVOUR_PARAMS.get(flavour)) is None:
             raise ValueError(f"Unknown flavour: {flavour}")
-        return self
+        return cls(filepath, **params | kwargs)
+
+
+# Functions ------------------------------------------------------------------------------------------------------------
+# `RESOURCES` is only read inside functions, as building it imports the app and in turn this module
+def _default_engine() -> _ENGINES:
+    """Returns the default parser engine, 'pyarrow' if installed, otherwise 'c'."""
+    from pathogenx import RESOURCES
+    return 'pyarrow' if 'pyarrow' in RESOURCES.optional_packages else 'c'
+
+
+def _cache_dir() -> Path:
+    """Returns the directory of the on-disk cache, `$XDG_CACHE_HOME/pathogenx`, resolved when used."""
+    from pathogenx import RESOURCES
+    return Path(environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / RESOURCES.package
+
+
+def _read_table(filepath: Path, sep: str = '\t', engine: _ENGINES = None, **kwargs) -> pd.DataFrame:
+    """Reads a delimited text file with the fastest available parser.
+
+    The multithreaded PyArrow parser is used if installed, otherwise the pandas C parser reads the whole file in one
+    pass from a memory map, rather than in low-memory chunks with mixed-type inference.
+
+    Args:
+        filepath (Path): The path to the file.
+        sep (str, optional): The separator used in the file. Defaults to '\t'.
+        engine (_ENGINES, optional): The parser engine. Defaults to 'pyarrow' if installed, otherwise 'c'.
+        **kwargs: Further keyword arguments passed to `pd.read_csv`.
+
+    Returns:
+        pd.DataFrame: The loaded data.
+    """
+    engine = engine or _default_engine()
+    if engine == 'c':
+        kwargs = {'low_memory': False, 'memory_map': True} | kwargs
+    return pd.read_csv(filepath, sep=sep, engine=engine, **kwargs)
+
+
+def _load_distance_square(filepath: Path, sep: str = '\t', symmetrical: bool = True, engine: _ENGINES = None,
+                          dtype: DTypeLike = np.float32) -> tuple[csr_matrix, list[str]]:
+    """Loads a square distance matrix with sample names in the header and first column.
+
+    The sample names are taken from the header line, so only the numeric block is parsed and it is compressed
+    straight from the dense array, rather than through an indexed DataFrame and a COO matrix.
+
+    Args:
+        filepath (Path): The path to the distance matrix file.
+        sep (str, optional): The separator used in the file. Defaults to '\t'.
+        symmetrical (bool, optional): Whether the matrix is symmetrical. Defaults to True.
+        engine (_ENGINES, optional): The parser engine, see `_read_table`.
+        dtype (DTypeLike, optional): The dtype of the distances. Defaults to float32.
+
+    Returns:
+        tuple[csr_matrix, list[str]]: The sparse distance matrix and the sample names.
+    """
+    with open(filepath, newline='') as f:
+        names = next(reader(f, delimiter=sep))[1:]
+    if (engine or _default_engine()) == 'pyarrow':  # Parse the wide numeric block in parallel blocks with Arrow directly
+        import pyarrow as pa
+        from pyarrow import csv
+        columns = [f'f{i}' for i in range(1, len(names) + 1)]  # Arrow's names for headerless columns
+        table = csv.read_csv(
+            filepath, read_options=csv.ReadOptions(use_threads=True, block_size=_ARROW_BLOCK_SIZE, skip_rows=1,
+                                                   autogenerate_column_names=True),
+            parse_options=csv.ParseOptions(delimiter=sep),
+            convert_options=csv.ConvertOptions(include_columns=columns,
+                                               column_types=dict.fromkeys(columns, pa.from_numpy_dtype(dtype)))
+        )
+        values = table.to_pandas().to_numpy()
+    else:
+        values = _read_table(filepath, sep=sep, engine=engine, header=None, skiprows=1,
+                             usecols=list(range(1, len(names) + 1)), dtype=dtype).to_numpy()
+    if not symmetrical:  # Symmetrise the dense array (in place unless Arrow's buffer is read-only), not two sparse ones
+        values = np.maximum(values, values.T, out=values if values.flags.writeable else None)
+    return csr_matrix(values), names
+
+
+def _load_distance_long(filepath: Path, sep: str = '\t', usecols: tuple[int, int, int] = (0, 1, 2),
+                        engine: _ENGINES = None, dtype: DTypeLike = np.float32) -> tuple[coo_matrix, list[str]]:
+    """Loads a long distance matrix with one (sample1, sample2, distance) row per pair and no header.
+
+    Args:
+        filepath (Path): The path to the distance matrix file.
+        sep (str, optional): The separator used in the file. Defaults to '\t'.
+        usecols (tuple[int, int, int], optional): The columns holding sample1, sample2 and the distance.
+            Defaults to (0, 1, 2).
+        engine (_ENGINES, optional): The parser engine, see `_read_table`.
+        dtype (DTypeLike, optional): The dtype of the distances. Defaults to float32.
+
+    Returns:
+        tuple[coo_matrix, list[str]]: The sparse distance matrix and the sample names.
+    """
+    if (engine or _default_engine()) == 'pyarrow':
+        return _load_distance_long_arrow(filepath, sep, usecols, dtype)
+    # Stream the file in chunks so only the int32 codes, not every name string, are held for the whole file. The parser
+    # decodes names straight to categoricals, hashing the raw tokens so only each chunk's unique names become strings
+    samples, rows, columns, data = pd.Index([], dtype=object), [], [], []
+    with _read_table(filepath, sep=sep, engine=engine, usecols=list(usecols), header=None,
+                     dtype={usecols[0]: 'category', usecols[1]: 'category', usecols[2]: dtype},
+                     chunksize=_CHUNK_SIZE) as chunks:
+        for chunk in chunks:
+            for names, codes in zip((chunk.iloc[:, 0], chunk.iloc[:, 1]), (rows, columns)):
+                # Map the chunk's categories to the running codes, adding any names not seen before
+                mapping = samples.get_indexer(names.cat.categories)
+                if (unseen := mapping < 0).any():
+                    mapping[unseen] = np.arange(len(samples), len(samples) + unseen.sum())
+                    samples = samples.append(names.cat.categories[unseen])
+                codes.append(mapping.astype(np.int32)[names.cat.codes.to_numpy()])
+            data.append(chunk.iloc[:, 2].to_numpy())
+    # Renumber the (cheap, integer) codes so names are in order of appearance in the first column then the second,
+    # independent of the chunk size; the first half of the codes are the rows, the second the columns
+    n = sum(map(len, rows))
+    codes, order = pd.factorize(np.concatenate(rows + columns) if rows else np.empty(0, dtype=np.int32))
+    codes = codes.astype(np.int32)  # Matches the index dtype COO would pick, so the matrix takes the codes uncopied
+    names = samples[order]
+    matrix = coo_matrix((np.concatenate(data) if data else np.empty(0, dtype=dtype), (codes[:n], codes[n:])),
+                        shape=(len(names), len(names)))
+    return matrix, _infer_names(names)
+
+
+def _load_distance_long_arrow(filepath: Path, sep: str = '\t', usecols: tuple[int, int, int] = (0, 1, 2),
+                              dtype: DTypeLike = np.float32) -> tuple[coo_matrix, list[str]]:
+    """PyArrow implementation of `_load_distance_long`.
+
+    The file is read from a memory map with the sample names dictionary-encoded as they are parsed, so the codes of
+    the COO matrix are the dictionary indices and no Python strings are created until the names are returned.
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    columns = [f'f{i}' for i in usecols]  # Arrow's names for headerless columns
+    names_type = pa.dictionary(pa.int32(), pa.string())
+    with pa.memory_map(str(filepath)) as source:
+        table = csv.read_csv(
+            source, read_options=csv.ReadOptions(autogenerate_column_names=True),
+            parse_options=csv.ParseOptions(delimiter=sep),
+            convert_options=csv.ConvertOptions(include_columns=columns,
+                                               column_types={columns[0]: names_type, columns[1]: names_type,
+                                                             columns[2]: pa.from_numpy_dtype(dtype)})
+        )
+    # Each chunk has its own dictionary; unifying them over both columns gives the names in order of appearance
+    samples = pa.chunked_array(table.column(0).chunks + table.column(1).chunks, type=names_type).unify_dictionaries()
+    codes = np.concatenate([chunk.indices.to_numpy() for chunk in samples.chunks] or [np.empty(0, dtype=np.int32)])
+    names = pd.Index(samples.chunks[0].dictionary.to_pandas() if samples.num_chunks else [], dtype=object)
+    n = len(table)
+    matrix = coo_matrix((table.column(2).to_numpy(), (codes[:n], codes[n:])), shape=(len(names), len(names)))
+    return matrix, _infer_names(names)
+
+
+def _infer_names(names: pd.Index) -> list:
+    """Converts sample names parsed as strings to numbers if they all are numeric, as `pd.read_csv` infers them.
+
+    This keeps numeric sample names matching the (inferred) index of genotype and metadata files.
+
+    Args:
+        names (pd.Index): The sample names as strings.
+
+    Returns:
+        list: The sample names, as numbers if all are numeric.
+    """
+    try:
+        return pd.to_numeric(names).tolist()
+    except (ValueError, TypeError):
+        return names.tolist()
@@ -9,18 +9,55 @@ import pickle
 import pandas as pd
 import numpy as np
 
-# import jax
-# import jax.numpy as jnp
-# from jax.scipy.special import expit
-# import numpyro
-# import numpyro.distributions as dist
-# from numpyro.infer import MCMC, NUTS, SVI, ELBO, Predictive
-# from numpyro.infer.autoguide import AutoNormal
-# import numpyro.optim as optim
+# from functools import cache
+# from os import cpu_count, environ
 #
+# # jax and numpyro take seconds to import, so they are imported where used rather than with this module
 from pathogenx.dataset import Dataset
 #
 #
+# # Functions ------------------------------------------------------------------------------------------------------------
+# @cache
+# def _set_host_device_count():
+#     """
+#     Exposes each CPU core to JAX as a host device, so MCMC chains can run in parallel.
+#
+#     JAX reads this once, when it initialises, so it is set once per process before the first `BayesianMixedModel`
+#     imports JAX. Callers who configure the devices themselves, with `numpyro.set_host_device_count` or `XLA_FLAGS`
+#     before creating a model, are left alone.
+#     """
+#     if '--xla_force_host_platform_device_count' not in environ.get('XLA_FLAGS', ''):
+#         import numpyro
+#         numpyro.set_host_device_count(cpu_count())
+#
+#
+# def _mixed_model(group_idx, n_groups: int, y_obs=None):
+#     """
+#     Numpyro model for `BayesianMixedModel`, a logistic regression with a random intercept per group.
+#
+#     Defined once at module level so NUTS and SVI trace it, and JAX can reuse the compiled kernels across fits
+#     with the same shapes, rather than the sample statements running eagerly inside `fit`.
+#     """
+#     import numpyro
+#     import numpyro.distributions as dist
+#
+#     # --- Priors ---
+#     # Global intercept
+#     intercept = numpyro.sample("Intercept", dist.Normal(0, 1.0))
+#     # Priors for the random effects (non-centered parameterization)
+#     sigma_group = numpyro.sample("sigma_group", dist.HalfNormal(1.0))
+#     with numpyro.plate("groups", n_groups):
+#         offset_group = numpyro.sample("offset_group", dist.Normal(0, 1.0))
+#     effect_group = numpyro.deterministic("effect_group", offset_group * sigma_group)
+#     # --- Linear Model (Logit-Link) ---
+#     # Map the random effects to the corresponding observations
+#     mu = intercept + effect_group[group_idx]
+#     # --- Likelihood ---
+#     # Use a plate for vectorized operations
+#     with numpyro.plate("data", group_idx.shape[0]):
+#         numpyro.sample("y_obs", dist.Bernoulli(logits=mu), obs=y_obs)
+#
+#
 # # Classes --------------------------------------------------------------------------------------------------------------
 class ModelResult(ABC):
     """
@@ -86,6 +123,9 @@ class Model(ABC):
 #         super().__init__()
 #         self.phenotype_col = phenotype_col
 #         self.group_col = group_col
+#         self._model_args = None  # (group codes, JAX arguments of `_mixed_model`), reused across fits
+#         _set_host_device_count()  # Before JAX initialises
+#         import jax
 #         self.rng_key = jax.random.PRNGKey(seed)
 #
 #     @classmethod
@@ -97,43 +137,57 @@ class Model(ABC):
 #             raise FileNotFoundError(f"No file found at {filepath}")
 #         return pickle.loads(filepath.read_bytes())
 #
-#     def _fit_mcmc(self, draws: int = 2000, chains: int = 4, warmup: int = 1000, **kwargs):
+#     def _fit_mcmc(self, model_args: dict, draws: int = 2000, chains: int = 4, warmup: int = 1000, **kwargs):
 #         """
 #         Fits the model using full MCMC sampling (NUTS sampler).
 #
 #         Args:
+#             model_args (dict): The data arguments of `_mixed_model`.
 #             draws (int): Number of samples to draw (per chain).
 #             chains (int): Number of chains to run.
 #             warmup (int): Number of warmup steps (per chain).
 #             **kwargs: Additional arguments passed to `numpyro.infer.MCMC()`.
 #         """
+#         import jax
+#         from numpyro.infer import MCMC, NUTS
+#
 #         self.rng_key, fit_key = jax.random.split(self.rng_key)
-#         kernel = NUTS(model)
-#         mcmc = MCMC(kernel, num_warmup=warmup, num_samples=draws, num_chains=chains, **kwargs)
-#         mcmc.run(fit_key, group_idx=group_codes_jax, y_obs=phenotype_data_jax)
+#         kernel = NUTS(_mixed_model)
+#         # Run chains on parallel devices, numpyro falls back to sequential if there are fewer devices than chains
+#         mcmc = MCMC(kernel, num_warmup=warmup, num_samples=draws, num_chains=chains,
+#                     **{'chain_method': 'parallel'} | kwargs)
+#         mcmc.run(fit_key, **model_args)
 #         # Get samples with chains as the first dimension
 #         # This returns a dict: {var_name: jnp.array[chain, draw, ...]}
 #         self.results = mcmc.get_samples(group_by_chain=True)
 #         return self.results
 #
-#     def _fit_vi(self, n_samples: int = 1000, n_steps: int = 20000, **kwargs):
+#     def _fit_vi(self, model_args: dict, n_samples: int = 1000, n_steps: int = 20000, **kwargs):
 #         """
 #         Fits the model using Variational Inference (ADVI).
 #
 #         Args:
+#             model_args (dict): The data arguments of `_mixed_model`.
 #             n_samples (int): How many samples to draw from the approximation.
 #             n_steps (int): Number of optimization steps.
 #             **kwargs: Additional arguments passed to `numpyro.infer.SVI()`.
 #         """
+#         import jax
+#         import numpyro.optim as optim
+#         from numpyro.infer import SVI, ELBO, Predictive
+#         from numpyro.infer.autoguide import AutoNormal
+#
 #         self.rng_key, fit_key, sample_key = jax.random.split(self.rng_key, 3)
-#         guide = AutoNormal(model)
+#         guide = AutoNormal(_mixed_model)
 #         optimizer = optim.Adam(step_size=0.01)
-#         svi = SVI(model, guide, optimizer, loss=ELBO())
-#         result = svi.run(fit_key, n_steps, group_idx=group_codes_jax, y_obs=phenotype_data_jax, **kwargs)
+#         svi = SVI(_mixed_model, guide, optimizer, loss=ELBO(), **kwargs)
+#         # Fuse the optimisation steps into one compiled loop, rather than dispatching each step from Python
+#         svi_state, _ = jax.lax.scan(lambda state, _: svi.update(state, **model_args),
+#                                     svi.init(fit_key, **model_args), None, length=n_steps)
 #
 #         # Sample from the approximate posterior
-#         predictive = Predictive(guide, params=result.params, num_samples=n_samples)
-#         posterior_samples = predictive(sample_key, group_idx=group_codes_jax)
+#         predictive = Predictive(guide, params=svi.get_params(svi_state), num_samples=n_samples)
+#         posterior_samples = predictive(sample_key, group_idx=model_args['group_idx'], n_groups=model_args['n_groups'])
 #
 #         # Standardize results to {var: [chain, draw, ...]} format (1 chain)
 #         # This makes it compatible with our plotting/summary functions
@@ -143,38 +197,30 @@ class Model(ABC):
 #         return results
 #
 #     def fit(self, dataset: Dataset, method: Literal['mcmc', 'vi'] = 'mcmc', **kwargs) -> BayesianMixedModelResult:
-#         data = dataset.data
-#         # Factorize data for Numpyro model
-#         group_codes, group_labels = pd.factorize(data[self.group_col])
-#         n_groups = len(group_labels)
-#         # Convert data to JAX arrays for the model
-#         phenotype_data_jax = jnp.array(data[self.phenotype_col].values)
-#         group_codes_jax = jnp.array(group_codes)
-#         # --- Priors ---
-#         # Global intercept
-#         intercept = numpyro.sample("Intercept", dist.Normal(0, 1.0))
-#         # Priors for the random effects (non-centered parameterization)
-#         sigma_group = numpyro.sample("sigma_group", dist.HalfNormal(1.0))
-#         # Numpyro needs sample_shape tuple
-#         offset_group = numpyro.sample("offset_group", dist.Normal(0, 1.0), sample_shape=(n_groups,))
-#         effect_group = numpyro.deterministic("effect_group", offset_group * sigma_group)
-#         # --- Linear Model (Logit-Link) ---
-#         # Map the random effects to the corresponding observations
-#         mu = intercept + effect_group[group_idx]
-#         # --- Likelihood ---
-#         # Use a plate for vectorized operations
-#         with numpyro.plate("data", len(group_idx)):
-#             numpyro.sample("y_obs", dist.Bernoulli(logits=mu), obs=y_obs)
+#         import jax.numpy as jnp
+#
+#         # Factorize data for Numpyro model, reusing the codes the dataset caches per column
+#         group_codes, group_labels = dataset.factorize(self.group_col)
+#         # Convert data to JAX arrays for the model, once per factorization so repeated fits skip the device transfer;
+#         # holding the codes keeps the identity check sound, and the dataset drops them if the column is recalculated
+#         if self._model_args is None or self._model_args[0] is not group_codes:
+#             # int32 halves the bandwidth of the effect_group[group_idx] gather, the hot path of every gradient step
+#             self._model_args = group_codes, {
+#                 'group_idx': jnp.asarray(group_codes, dtype=jnp.int32), 'n_groups': len(group_labels),
+#                 'y_obs': jnp.asarray(dataset[self.phenotype_col].values, dtype=jnp.int32)
+#             }
+#         model_args = self._model_args[1]
 #
 #         if method == 'mcmc':
-#             return self._fit_mcmc(**kwargs)
+#             return self._fit_mcmc(model_args, **kwargs)
 #         elif method == 'vi':
-#             return self._fit_vi(**kwargs)
+#             return self._fit_vi(model_args, **kwargs)
 #         else:
 #             raise NotImplementedError(f"Method {method} not implemented.")
 #
 #
 # # def _model_pipeline(self):
+# #     from jax.scipy.special import expit
 # #     if self.results is None:
 # #         raise BayesianMixedModelError("Model has not been fitted. Call a fit method first.")
 # #
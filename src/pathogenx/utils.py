@@ -1,15 +1,21 @@
 from typing import Union, Iterable
-from itertools import groupby
 from operator import attrgetter, itemgetter
 
 
+# Constants ------------------------------------------------------------------------------------------------------------
+_BOLD = "\033[1m%s\033[0m"
+
+
 # Functions ------------------------------------------------------------------------------------------------------------
 def grouper(iterable: Iterable, key: Union[str, int]):
-    """Shortcut for sorting and grouping"""
+    """Shortcut for grouping into lists in a single pass, yielded in order of first appearance"""
     getter = attrgetter(key) if isinstance(key, str) else itemgetter(key)
-    yield from groupby(sorted(iterable, key=getter), key=getter)
+    groups = {}
+    for item in iterable:
+        groups.setdefault(getter(item), []).append(item)
+    yield from groups.items()
 
 
 def bold(string: str) -> str:
     """Returns the string in bold"""
-    return f"\033[1m{string}\033[0m"
+    return _BOLD % string
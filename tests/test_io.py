@@ -0,0 +1,84 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from pathogenx import io
+from pathogenx.io import DistFile
+
+
+# Constants ------------------------------------------------------------------------------------------------------------
+_PAIRS = [('A', 'B', 3), ('A', 'C', 5), ('B', 'C', 1), ('C', 'D', 7), ('D', 'A', 2)]
+_NAMES = ['A', 'B', 'C', 'D']
+_NUMERIC_NAMES = {'A': '100', 'B': '101', 'C': '200', 'D': '7'}
+
+
+# Functions ------------------------------------------------------------------------------------------------------------
+def _write_long(path: Path, flavour: str, names: dict[str, str] = None) -> Path:
+    """Writes `_PAIRS` in the column layout of a long distance flavour, with optional renaming of the samples."""
+    names = names or {}
+    with open(path, 'w') as f:
+        for a, b, d in _PAIRS:
+            a, b = names.get(a, a), names.get(b, b)
+            if flavour == 'mash':  # Distances are read from the fourth column
+                f.write(f'{a}\t{b}\t0.01\t{d}\t900/1000\n')
+            elif flavour == 'ska1':  # SNPs are the seventh column
+                f.write(f'{a}\t{b}\t0.9\t10\t20\t0.5\t{d}\t0\n')
+            else:  # ska2: distances are the third column
+                f.write(f'{a}\t{b}\t{d}\t0\n')
+    return path
+
+
+def _expected(names: list) -> np.ndarray:
+    """Returns the dense matrix of `_PAIRS` in the order of `names`, as sample1 to sample2 distances."""
+    index = {name: i for i, name in enumerate(names)}
+    matrix = np.zeros((len(names), len(names)))
+    for a, b, d in _PAIRS:
+        matrix[index[a], index[b]] = d
+    return matrix
+
+
+@pytest.fixture(params=[None, 2], ids=['whole', 'chunked'])
+def chunk_size(request, monkeypatch):
+    """Runs the long loader in one chunk, or in chunks of two rows so names span chunks."""
+    if request.param is not None:
+        monkeypatch.setattr(io, '_CHUNK_SIZE', request.param)
+    return request.param
+
+
+# Tests ----------------------------------------------------------------------------------------------------------------
+def test_pw_dist(tmp_path):
+    path = tmp_path / 'dist.csv'
+    matrix = _expected(_NAMES)
+    matrix = matrix + matrix.T
+    path.write_text(','.join([''] + _NAMES) + '\n' +
+                    ''.join(','.join([name, *map(str, row.astype(int))]) + '\n' for name, row in zip(_NAMES, matrix)))
+    loaded, names = DistFile.from_flavour(path, 'pw-dist', engine='c').load()
+    assert names == _NAMES
+    np.testing.assert_array_equal(loaded.toarray(), matrix)
+
+
+@pytest.mark.parametrize('flavour', ['mash', 'ska1', 'ska2'])
+def test_long(tmp_path, flavour, chunk_size):
+    path = _write_long(tmp_path / f'{flavour}.tsv', flavour)
+    loaded, names = DistFile.from_flavour(path, flavour, engine='c').load()
+    assert names == _NAMES  # In order of appearance in the first column, then the second
+    np.testing.assert_array_equal(loaded.toarray(), _expected(names))
+    assert loaded.dtype == np.float32
+
+
+def test_long_numeric_names(tmp_path, chunk_size):
+    path = _write_long(tmp_path / 'ska2.tsv', 'ska2', _NUMERIC_NAMES)
+    loaded, names = DistFile.from_flavour(path, 'ska2', engine='c').load()
+    assert names == [int(_NUMERIC_NAMES[name]) for name in _NAMES]  # Parsed as numbers, like the genotype index
+    np.testing.assert_array_equal(loaded.toarray(), _expected(_NAMES))
+
+
+def test_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    path = _write_long(tmp_path / 'ska2.tsv', 'ska2')
+    parsed = DistFile.from_flavour(path, 'ska2', engine='c', cache=True).load()
+    cached = DistFile.from_flavour(path, 'ska2', engine='c', cache=True).load()
+    assert cached[1] == parsed[1]
+    np.testing.assert_array_equal(cached[0].toarray(), parsed[0].toarray())
+    assert len(list((tmp_path / 'cache' / 'pathogenx').glob('*.npz'))) == 1